@@ -1,21 +1,24 @@
 """Pre-serialize a (possibly cyclic) object graph to a simple tree."""
 
-from __future__ import print_function
-
-from collections import OrderedDict
+import functools
 import re
 import sys
 
-from fn.recur import stackless
-
 __version__ = "2017.7"
-IS_PYTHON2 = sys.version_info.major < 3
-STR = unicode if IS_PYTHON2 else str
-PRIMITIVE = int, float, STR
+PRIMITIVE = (int, float, str)
 IDENTIFIER_PATTERN = r"[^\d\W]\w*"
 TYPE_NAME_PATTERN = r"[{escape_char}]?([^\d\W]\w*)?([.][^\d\W]\w*)*"
 DATA = u""
 
+_IDENTIFIER_RE = re.compile(IDENTIFIER_PATTERN, re.UNICODE)
+
+
+@functools.lru_cache(maxsize=8)
+def _type_name_re(escape_char):
+    """Return the compiled :const:`TYPE_NAME_PATTERN` for ``escape_char``."""
+    return re.compile(TYPE_NAME_PATTERN.format(escape_char=escape_char),
+                      re.UNICODE)
+
 
 class PreserializeError(Exception):
     """Parent Exception for this module."""
@@ -31,13 +34,12 @@ class UnregisteredTypeError(PreserializeError):
 
 def is_identifier(s):
     """Check if ``s`` is a valid Python identifier."""
-    return re.fullmatch(IDENTIFIER_PATTERN, s, re.UNICODE)
+    return _IDENTIFIER_RE.fullmatch(s)
 
 
 def is_type_name(escape_char, s):
     """Check if ``s`` matches regex :const:`TYPE_NAME_PATTERN`."""
-    return re.fullmatch(TYPE_NAME_PATTERN.format(escape_char=escape_char),
-                        s, re.UNICODE)
+    return _type_name_re(escape_char).fullmatch(s)
 
 
 def cast_int(s):
@@ -71,7 +73,8 @@ class Deconstructor(object):
         :type ignore: list
         """
         self.cls = cls
-        self.name = cls.__name__.lower() if name is None else name
+        self.name = sys.intern(
+            cls.__name__.lower() if name is None else name)
         if not is_type_name(escape_char, self.name):
             raise PreserializeError(
                 u'Cannot use "{0}" as type name.'.format(self.name))
@@ -139,11 +142,12 @@ class DictDeconstructor(Deconstructor):
     """Deconstructor for a ``dict``. Uses kwargs if possible."""
 
     def deconstruct(self, obj):
-        if all(isinstance(key, STR) and is_identifier(key)
-               for key in obj.keys()):
-            return None, obj
-        else:
-            return list(list(item) for item in obj.items()), None  # unpack
+        match = _IDENTIFIER_RE.fullmatch
+        str_t = str
+        for key in obj:
+            if type(key) is not str_t or not match(key):
+                return [[k, v] for k, v in obj.items()], None  # unpack
+        return None, obj
 
     def construct(self, args, kwargs):
         return super().construct((args,), kwargs)  # repack
@@ -156,8 +160,11 @@ class InstanceDeconstructor(Deconstructor):
     """Deconstructor for a class instance. Uses ``vars()``."""
 
     def deconstruct(self, obj):
-        return None, dict((key, value) for key, value in vars(obj).items()
-                          if key not in self.ignore)
+        if self.ignore:
+            return None, dict((key, value)
+                              for key, value in vars(obj).items()
+                              if key not in self.ignore)
+        return None, vars(obj).copy()
 
     def setattr(self, obj, key, value):
         vars(obj)[key] = value
@@ -166,7 +173,7 @@ class InstanceDeconstructor(Deconstructor):
 BASIC_TYPES = (
     (int,),
     (float,),
-    (STR,),
+    (str,),
     (tuple, IterableDeconstructor),
     (set, IterableDeconstructor))
 
@@ -181,9 +188,10 @@ class LinkManager(object):
     KEY = u""
 
     def __init__(self):
-        self._path_cache = {}  # id(obj) -> path
+        self._path_cache = {}  # id(obj) -> (path, obj)
         self._object_cache = {}  # path -> obj
-        self._links = OrderedDict()  # dest -> [i, [source, ...]]
+        self._container_cache = {}  # path -> produced container datum
+        self._links = {}  # dest -> [i, [source, ...]]
         self._parent_deconstructors = dict()  # path -> Deconstructor
 
     @classmethod
@@ -192,12 +200,24 @@ class LinkManager(object):
         return cls.KEY[0]
 
     def path_cache_add(self, obj, path):
-        """For pre-serialization, add ``obj`` -> ``path`` to cache."""
-        self._path_cache[id(obj)] = path
+        """For pre-serialization, add ``obj`` -> ``path`` to cache.
+
+        ``obj`` itself is kept in the cache entry so its ``id`` cannot
+        be recycled by the garbage collector mid-traversal.
+        """
+        self._path_cache[id(obj)] = (path, obj)
 
     def path_cache_get(self, obj):
         """Return the ``path`` for ``obj``."""
-        return self._path_cache[id(obj)]
+        return self._path_cache[id(obj)][0]
+
+    def container_cache_add(self, path, data):
+        """For pre-serialization, add produced container ``data`` at ``path``.
+
+        Lets :meth:`label_data` reach each destination's parent directly
+        instead of walking the whole path from the root.
+        """
+        self._container_cache[path] = data
 
     def object_cache_add(self, path, obj):
         """For de-pre-serialization, add ``path`` -> ``obj`` to cache."""
@@ -257,8 +277,9 @@ class LinkManager(object):
         """Label each destination in ``data``."""
         for dest, (i, sources) in self._links.items():
             if dest:
-                self.setitem(data, dest, self.label_destination(
-                    i, self.getitem(data, dest)))
+                parent = self._container_cache[dest[:-1]]
+                key = dest[-1]
+                parent[key] = self.label_destination(i, parent[key])
             else:
                 data = self.label_destination(i, data)
         return data
@@ -313,10 +334,14 @@ class Preserializer(object):
 
         self.type_key = self.TYPE.format(escape_char=self.escape_char)
         self.version_key = self.VERSION.format(escape_char=self.escape_char)
+        self._reserved_keys = frozenset((self.type_key, self.version_key))
 
         self.deconstructors = {}  # (type, version) -> Deconstructor
         self.versions = {}        # type -> version
         self.types = {}           # (name, version) -> type
+        self._type_to_deconstructor = {}  # type -> current Deconstructor
+        self._dispatch = {list: self._emit_list}  # type -> node handler
+        self._passthrough_types = set()  # types that pre-serialize to self
 
         self.register_types(types)
 
@@ -343,6 +368,15 @@ class Preserializer(object):
             version = None
 
         self.deconstructors[cls, version] = deconstructor
+        self._type_to_deconstructor[cls] = deconstructor
+        if cls is not list:  # a list node always traverses as a list
+            if deconstructor is None:
+                self._dispatch[cls] = self._emit_value
+                self._passthrough_types.add(cls)
+            else:
+                self._dispatch[cls] = functools.partial(
+                    self._emit_mapping, deconstructor)
+                self._passthrough_types.discard(cls)
 
         if version is not None:
             self.versions[cls] = version
@@ -369,7 +403,7 @@ class Preserializer(object):
         :rtype: Deconstructor
         """
         try:
-            return self.deconstructors[t, self.versions.get(t)]
+            return self._type_to_deconstructor[t]
         except KeyError:
             raise UnregisteredTypeError(
                 format(u"Cannot pre-serialize {0}".format(t.__name__)))
@@ -410,7 +444,7 @@ class Preserializer(object):
         :rtype: basic
         """
         link_manager = self.link_manager_cls()
-        data = self._preserialize(self, obj, (), link_manager)
+        data = self._preserialize(obj, (), link_manager)
         data = link_manager.label_data(data)  # can change top datum
         return data
 
@@ -424,106 +458,234 @@ class Preserializer(object):
         :rtype: object
         """
         link_manager = self.link_manager_cls()
-        obj = self._depreserialize(self, data, (), data, link_manager, None)
+        obj = self._depreserialize(data, (), data, link_manager, None)
         link_manager.set_sources(obj)
         return obj
 
-    @stackless
-    def _preserialize(self, obj, path, link_manager):
-        t = type(obj)
+    def _preserialize(self, root, path, link_manager):
+        # Iterative depth-first traversal: each work item fills one slot
+        # (``container[key]``) with the datum produced for ``obj``, and
+        # is dispatched to a per-type handler precomputed at register()
+        # time. A work item carries ``(parent_path, pkey)`` rather than
+        # a materialized path; handlers build the full tuple only for
+        # nodes that actually need one (composites and references), so
+        # primitive slots never allocate a path.
+        result = [None]
+        stack = [(root, None, path, result, 0)]
+        pop = stack.pop
+        dispatch = self._dispatch
+        passthrough = self._passthrough_types
+
+        while stack:
+            item = pop()
+            obj = item[0]
+            if type(obj) in passthrough:  # most nodes are primitives
+                item[3][item[4]] = obj
+                continue
+            try:
+                handler = dispatch[type(obj)]
+            except KeyError:
+                raise UnregisteredTypeError(
+                    format(u"Cannot pre-serialize {0}".format(
+                        type(obj).__name__)))
+            handler(item, link_manager, stack)
+
+        return result[0]
 
-        if t != list:
-            deconstructor = self.get_deconstructor_from_type(t)
-            if deconstructor is None:
-                yield obj
-                return
+    @staticmethod
+    def _item_path(item):
+        """Materialize the path of a work item.
 
+        A ``parent_path`` of ``None`` marks the root item, whose
+        already-built path sits in the ``pkey`` slot.
+        """
+        parent_path = item[1]
+        return item[2] if parent_path is None else parent_path + (item[2],)
+
+    def _emit_value(self, item, link_manager, stack):
+        """Handler for a registered type that pre-serializes to itself."""
+        item[3][item[4]] = item[0]
+
+    def _emit_ref(self, obj, path, container, key, link_manager):
+        """Emit a reference if ``obj`` was already visited."""
         try:
             dest_path = link_manager.path_cache_get(obj)
-            link_manager.add(path, dest_path)
-            yield link_manager.make_ref(dest_path)
-            return
         except KeyError:
-            pass
-
+            return False
+        link_manager.add(path, dest_path)
+        container[key] = link_manager.make_ref(dest_path)
+        return True
+
+    def _emit_list(self, item, link_manager, stack):
+        """Handler for a ``list`` node."""
+        obj, _, _, container, key = item
+        path = self._item_path(item)
+        if self._emit_ref(obj, path, container, key, link_manager):
+            return
         link_manager.path_cache_add(obj, path)
 
-        if t == list:
-            data = self.list_type()
-            for i, item in enumerate(obj):
-                data.append((yield self._preserialize.call(
-                    self, item, path + (i,), link_manager)))
-        else:
-            data = self.mapping_type()
-            data[self.type_key] = deconstructor.name
-            if deconstructor.version is not None:
-                data[self.version_key] = deconstructor.version
-
-            args, kwargs = deconstructor.deconstruct(obj)
-            if args:
-                data[DATA] = self.list_type()
-                for i, arg in enumerate(args):
-                    data[DATA].append((yield self._preserialize.call(
-                        self, arg, path + (DATA, i), link_manager)))
-
-            if kwargs:
-                for key, attr in kwargs.items():
-                    ekey = self.encoder.encode(key)
-                    data[ekey] = yield self._preserialize.call(
-                        self, attr, path + (ekey,), link_manager)
-        yield data
-
-    @stackless
-    def _depreserialize(self, data, path, doc, link_manager,
-                        parent_deconstructor):
-        t = type(data)
-
-        if t != self.list_type and t != self.mapping_type:
-            deconstructor = self.get_deconstructor_from_type(t)
-            if deconstructor is None:
-                yield data
-                return
+        data = self.list_type()
+        link_manager.container_cache_add(path, data)
+        children = []
+        grow = data.append
+        push = children.append
+        passthrough = self._passthrough_types
+        for i, child in enumerate(obj):
+            if type(child) in passthrough:  # fill primitives in place
+                grow(child)
+            else:
+                grow(None)
+                push((child, path, i, data, i))
 
-        if link_manager.is_ref(data):
-            dest_path = tuple(cast_int(key)
-                              for key in link_manager.ref_path(data)
-                              if key != DATA)
+        stack.extend(reversed(children))  # preserve left-to-right order
+        container[key] = data
 
-            try:
-                yield link_manager.object_cache_get(dest_path)
-                return
-            except KeyError:
-                pass
-
-            link_manager.add(path, dest_path)
-            link_manager.set_source_parent_deconstructor(
-                path, parent_deconstructor)
-            yield data
+    def _emit_mapping(self, deconstructor, item, link_manager, stack):
+        """Handler for a node with a :class:`Deconstructor`."""
+        obj, _, _, container, key = item
+        path = self._item_path(item)
+        if self._emit_ref(obj, path, container, key, link_manager):
             return
+        link_manager.path_cache_add(obj, path)
 
-        if t == self.list_type:
-            obj = []
-            for i, item in enumerate(data):
-                obj.append((yield self._depreserialize.call(
-                    self, item, path + (i,), doc, link_manager, None)))
+        if deconstructor.version is not None:
+            data = self.mapping_type(
+                ((self.type_key, deconstructor.name),
+                 (self.version_key, deconstructor.version)))
         else:
-            deconstructor = self.get_deconstructor_from_data(data)
-            args = []
-            kwargs = {}
-            for key, item in data.items():
-                if key == DATA:
-                    for i, arg in enumerate(item):
-                        args.append((yield self._depreserialize.call(
-                            self, arg, path + (i,), doc, link_manager,
-                            deconstructor)))
-                elif key not in {self.type_key, self.version_key}:
-                    dkey = self.encoder.decode(key)
-                    kwargs[dkey] = yield self._depreserialize.call(
-                        self, item, path + (dkey,), doc, link_manager,
-                        deconstructor)
-            obj = deconstructor.construct(args, kwargs)
-        link_manager.object_cache_add(path, obj)
-        yield obj
+            data = self.mapping_type(((self.type_key, deconstructor.name),))
+        link_manager.container_cache_add(path, data)
+
+        children = []
+        push = children.append
+        passthrough = self._passthrough_types
+        args, kwargs = deconstructor.deconstruct(obj)
+        if args:
+            adata = data[DATA] = self.list_type()
+            dpath = path + (DATA,)
+            link_manager.container_cache_add(dpath, adata)
+            grow = adata.append
+            for i, arg in enumerate(args):
+                if type(arg) in passthrough:  # fill primitives in place
+                    grow(arg)
+                else:
+                    grow(None)
+                    push((arg, dpath, i, adata, i))
+
+        if kwargs:
+            encode = self.encoder.encode
+            for kwkey, attr in kwargs.items():
+                ekey = encode(kwkey)
+                if type(attr) in passthrough:  # fill primitives in place
+                    data[ekey] = attr
+                else:
+                    data[ekey] = None
+                    push((attr, path, ekey, data, ekey))
+
+        stack.extend(reversed(children))  # preserve left-to-right order
+        container[key] = data
+
+    def _depreserialize(self, root, path, doc, link_manager,
+                        parent_deconstructor):
+        # Iterative post-order traversal: a *visit* item examines a datum
+        # and queues its children, followed by a *finish* item that
+        # constructs the object once all child slots are filled. As in
+        # :meth:`_preserialize`, visit items carry ``(parent_path,
+        # pkey)`` and the full path tuple is built only for composites
+        # and references.
+        VISIT, FINISH = 0, 1
+        result = [None]
+        stack = [(VISIT, root, None, path, parent_deconstructor, result, 0)]
+        pop = stack.pop
+
+        list_type = self.list_type
+        mapping_type = self.mapping_type
+        reserved_keys = self._reserved_keys
+        # Passthrough data can be filled in place at expansion time;
+        # exclude the container types in case they were also registered.
+        simple = self._passthrough_types.difference((list_type, mapping_type))
+        decode = self.encoder.decode
+        is_ref = link_manager.is_ref
+        object_cache_add = link_manager.object_cache_add
+        object_cache_get = link_manager.object_cache_get
+
+        while stack:
+            record = pop()
+
+            if record[0] == FINISH:
+                _, path, deconstructor, args, kwargs, container, key = record
+                if deconstructor is None:  # list node: args is the object
+                    obj = args
+                else:
+                    obj = deconstructor.construct(args, kwargs)
+                object_cache_add(path, obj)
+                container[key] = obj
+                continue
+
+            (_, data, parent_path, pkey, parent_deconstructor,
+             container, key) = record
+            t = type(data)
+
+            if t != list_type and t != mapping_type:
+                deconstructor = self.get_deconstructor_from_type(t)
+                if deconstructor is None:
+                    container[key] = data
+                    continue
+
+            path = pkey if parent_path is None else parent_path + (pkey,)
+
+            if is_ref(data):
+                dest_path = tuple(cast_int(dkey)
+                                  for dkey in link_manager.ref_path(data)
+                                  if dkey != DATA)
+
+                try:
+                    container[key] = object_cache_get(dest_path)
+                except KeyError:
+                    link_manager.add(path, dest_path)
+                    link_manager.set_source_parent_deconstructor(
+                        path, parent_deconstructor)
+                    container[key] = data
+                continue
+
+            children = []
+            push = children.append
+            if t == list_type:
+                args = [None] * len(data)
+                deconstructor = None
+                kwargs = None
+                for i, item in enumerate(data):
+                    if type(item) in simple:  # fill primitives in place
+                        args[i] = item
+                    else:
+                        push((VISIT, item, path, i, None, args, i))
+            else:
+                deconstructor = self.get_deconstructor_from_data(data)
+                args = []
+                kwargs = {}
+                for dkey, item in data.items():
+                    if dkey == DATA:
+                        args = [None] * len(item)
+                        for i, arg in enumerate(item):
+                            if type(arg) in simple:
+                                args[i] = arg
+                            else:
+                                push((VISIT, arg, path, i,
+                                      deconstructor, args, i))
+                    elif dkey not in reserved_keys:
+                        dkey = decode(dkey)
+                        if type(item) in simple:
+                            kwargs[dkey] = item
+                        else:
+                            kwargs[dkey] = None
+                            push((VISIT, item, path, dkey,
+                                  deconstructor, kwargs, dkey))
+
+            stack.append((FINISH, path, deconstructor, args, kwargs,
+                          container, key))
+            stack.extend(reversed(children))  # preserve left-to-right order
+
+        return result[0]
 
 
 class Encoder(object):
@@ -576,8 +738,15 @@ class IdentifierEscapeEncoder(Encoder):
         :type char:
         """
         self.char = char
-
-    def encode(self, s):
+        self._double = char*2
+        self._encode_table = str.maketrans({char: self._double})
+        self._decode_re = re.compile(re.escape(self._double))
+        # Keys repeat massively across a graph; memoize per instance so
+        # the cache lives exactly as long as its Preserializer.
+        self.encode = functools.lru_cache(maxsize=1024)(self._encode_impl)
+        self.decode = functools.lru_cache(maxsize=1024)(self._decode_impl)
+
+    def _encode_impl(self, s):
         """Check ``s`` is a valid Python identifier and :attr:`char`-escape.
 
         :param s: The string to escape.
@@ -586,13 +755,16 @@ class IdentifierEscapeEncoder(Encoder):
         :returns: The escaped string.
         :rtype: str
         """
-        s = STR(s)
+        s = str(s)
         if is_identifier(s):
-            return self.char if s == DATA else s.replace(self.char,
-                                                         self.char*2)
+            if s == DATA:
+                return self.char
+            # Interned keys share one backing string across all emitted
+            # mappings, so later dict probes hit the identity shortcut.
+            return sys.intern(s.translate(self._encode_table))
         raise PreserializeError(u"Not a valid key name: {0!r}".format(s))
 
-    def decode(self, s):
+    def _decode_impl(self, s):
         """Undo ``char``-escaping.
 
         :param s: The escaped string.
@@ -601,4 +773,4 @@ class IdentifierEscapeEncoder(Encoder):
         :returns: The unescaped string.
         :rtype: str
         """
-        return DATA if s == self.char else s.replace(self.char*2, self.char)
+        return DATA if s == self.char else self._decode_re.sub(self.char, s)
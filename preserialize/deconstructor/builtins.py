@@ -1,14 +1,14 @@
 import importlib
 
-from .. import Deconstructor, STR
+from .. import Deconstructor
 
 
 class TypeDeconstructor(Deconstructor):
     name = u"type"
 
     def deconstruct(self, obj):
-        return None, {u"name" : STR(obj.__name__),
-                      u"module" : STR(obj.__module__)}
+        return None, {u"name" : str(obj.__name__),
+                      u"module" : str(obj.__module__)}
 
     def construct(self, args, kwargs):
         class_name, module_name = kwargs["name"], kwargs["module"]
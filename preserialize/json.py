@@ -1,5 +1,3 @@
-from jsonpointer import JsonPointer
-
 from . import BASIC_TYPES, DictDeconstructor, LinkManager, Preserializer
 
 JSON_TYPES = BASIC_TYPES + (
@@ -12,6 +10,21 @@ class JsonReferenceError(Exception):
     pass
 
 
+def _to_pointer(parts):
+    """Build a JSON Pointer string from path ``parts``."""
+    return u"".join(u"/" + str(part).replace(u"~", u"~0").replace(u"/", u"~1")
+                    for part in parts)
+
+
+def _from_pointer(pointer):
+    """Split JSON Pointer string ``pointer`` into unescaped parts."""
+    if pointer and not pointer.startswith(u"/"):
+        raise JsonReferenceError(
+            u"Invalid JSON Pointer: {0}".format(pointer))
+    return [part.replace(u"~1", u"/").replace(u"~0", u"~")
+            for part in pointer.split(u"/")[1:]]
+
+
 class JsonReferenceLinkManager(LinkManager):
     "JSON Reference"
 
@@ -26,7 +39,9 @@ class JsonReferenceLinkManager(LinkManager):
         :returns: If ``obj`` looks like a JSON Reference.
         :rtype: bool
         """
-        return isinstance(obj, dict) and len(obj) == 1 and self.KEY in obj
+        # Exact-type check and literal key: this runs for every node
+        # visited during de-pre-serialization.
+        return type(obj) is dict and len(obj) == 1 and u"$ref" in obj
 
     def make_ref(self, dest):
         """Make a JSON Reference from a *path*.
@@ -37,7 +52,7 @@ class JsonReferenceLinkManager(LinkManager):
         :returns: Dictionary mapping the key ``$ref`` to JSON Pointer.
         :rtype: dict
         """
-        return {self.KEY: u"#{0}".format(JsonPointer.from_parts(dest).path)}
+        return {self.KEY: u"#" + _to_pointer(dest)}
 
     def ref_path(self, ref):
         """Return the *path* inside the JSON Reference.
@@ -50,7 +65,7 @@ class JsonReferenceLinkManager(LinkManager):
         """
         v = ref[self.KEY]
         if v.startswith(u"#"):
-            return JsonPointer(v[1:]).parts
+            return _from_pointer(v[1:])
         raise JsonReferenceError(u"Unsupported reference: {0}".format(v))
 
 
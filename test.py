@@ -1,3 +1,4 @@
+import sys
 import unittest
 
 from preserialize.json import JsonPreserializer
@@ -111,3 +112,29 @@ class JsonTests(unittest.TestCase):
                                       "from_egg": {"$type": "egg",
                                                    "from_parrot": {"$ref": "#//2/1"}}}]]}
         self.assertEqual(self.preserializer.preserialize(obj), result)
+
+
+    def test_cyclic_roundtrip(self):
+        data = self.preserializer.preserialize(self.parrot)
+        back = self.preserializer.depreserialize(data)
+        self.assertTrue(back.is_dead)
+        self.assertIs(back.from_egg.from_parrot, back)
+
+    def test_shared_subobject_roundtrip(self):
+        shared = [1, 2]
+        obj = [shared, {'x': shared}]
+        back = self.preserializer.depreserialize(
+            self.preserializer.preserialize(obj))
+        self.assertEqual(back, [[1, 2], {'x': [1, 2]}])
+        self.assertIs(back[0], back[1]['x'])
+
+    def test_deep_nesting(self):
+        depth = sys.getrecursionlimit() + 100
+        obj = 123
+        for _ in range(depth):
+            obj = [obj]
+        back = self.preserializer.depreserialize(
+            self.preserializer.preserialize(obj))
+        for _ in range(depth):
+            back = back[0]
+        self.assertEqual(back, 123)